@@ -1,5 +1,6 @@
 from misc.adapter import log
 from misc.config import Config
+from misc.profiler import LagMonitor, Profiler
 from modules.deckedit import DeckEditModule
 import discord
 
@@ -10,6 +11,10 @@ class Bot:
         self.bot = None
         self.modules = []
         self.config = Config()
+        self.profiler = Profiler(
+            max_duration=self.config.get("profile-max-duration", 300))
+        self.lag_monitor = LagMonitor(self.config.get("lag-threshold", 0.25),
+                                      self.config.get("lag-interval", 0.5))
 
     async def on_ready(self):
         """Event handler for when the bot is ready."""
@@ -17,10 +22,15 @@ class Bot:
         game = self.config.get("game-presence", "Skynet")
         await self.bot.change_presence(activity=discord.Game(name=game))
 
-        log("Loading modules...")
-        self.modules = [
-            DeckEditModule(self, self.bot)
-        ]
+        log("Starting event loop lag monitor...")
+        self.lag_monitor.start()
+
+        # Keep the modules (and their state) across reconnects
+        if len(self.modules) == 0:
+            log("Loading modules...")
+            self.modules = [
+                DeckEditModule(self, self.bot)
+            ]
 
         log("Initialization complete, %d modules loaded." % len(self.modules))
 
@@ -1,8 +1,19 @@
 from misc.adapter import create_bot, connect_bot
+from misc.traffic import TrafficRecorder
 from bot import Bot
 
 if __name__ == "__main__":
     rf = Bot()
-    bot = create_bot(rf, rf.config.get("cmd-prefix", "."))
+    traffic_log = rf.config.get("traffic-log", "")
+    recorder = None
+    if traffic_log:
+        recorder = TrafficRecorder(traffic_log,
+                                   rf.config.get("traffic-commands", ["kgf"]),
+                                   rf.config.get("admins", []))
+    bot = create_bot(rf, rf.config.get("cmd-prefix", "."), recorder)
     rf.bot = bot
-    connect_bot(bot)
+    try:
+        connect_bot(bot)
+    finally:
+        if recorder is not None:
+            recorder.close()
@@ -2,11 +2,13 @@ import discord
 from misc.util import init_logging, log
 
 
-def create_bot(piggyback, cmdprefix="."):
+def create_bot(piggyback, cmdprefix=".", recorder=None):
     """Create a bot and setup logging.
 
     Args:
         piggyback: The piggyback object.
+        cmdprefix: The command prefix.
+        recorder: An optional TrafficRecorder that commands are written to.
     """
     init_logging()
     bot = discord.Client()
@@ -50,6 +52,8 @@ def create_bot(piggyback, cmdprefix="."):
                 return
 
             log("Got '{0}' from {1.author}".format(command, message))
+            if recorder is not None:
+                recorder.record(parts[0], parts[1:], message.author.id)
             await bot.data.handle_command(message, parts[0], parts[1:])
 
     return bot
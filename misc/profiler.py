@@ -0,0 +1,182 @@
+import asyncio
+import cProfile
+import io
+import pstats
+import sys
+import threading
+import traceback
+from misc.util import log
+from time import monotonic
+
+
+class Profiler:
+
+    def __init__(self, limit=50, max_duration=300):
+        """Constructor.
+
+        Args:
+            limit: The number of functions listed in a report.
+            max_duration: The time (in seconds) after which a session is
+                stopped automatically.
+        """
+        self._limit = limit
+        self._max_duration = max_duration
+        self._profile = None
+        self._started = None
+        self._timeout = None
+        self._report = None
+
+    @property
+    def running(self):
+        """Whether a profiling session is currently active."""
+        return self._profile is not None
+
+    def start(self):
+        """Starts a profiling session.
+
+        Must be called from within the event loop. The session only covers the
+        thread that calls this method, which is the thread running the event
+        loop.
+        """
+        if self.running:
+            raise ValueError("Profiler already running")
+        profile = cProfile.Profile()
+        profile.enable()
+
+        # Only mark the session as running once profiling is actually enabled
+        self._profile = profile
+        self._started = monotonic()
+        self._report = None
+        self._timeout = asyncio.get_running_loop().call_later(
+            self._max_duration, self._expire)
+
+    def stop(self):
+        """Stops the profiling session.
+
+        If the session was already stopped automatically, its report is
+        returned instead.
+
+        Returns:
+            The profiling report as a string.
+        """
+        if not self.running:
+            if self._report is None:
+                raise ValueError("Profiler not running")
+            report, self._report = self._report, None
+            return report
+        self._timeout.cancel()
+        self._timeout = None
+        return self._finish()
+
+    def _expire(self):
+        """Stops a session that has reached the maximum duration."""
+        self._timeout = None
+        self._report = self._finish()
+        log("Profiling stopped automatically after %d second(s)."
+            % self._max_duration)
+
+    def _finish(self):
+        """Ends the profiling session.
+
+        Returns:
+            The profiling report as a string.
+        """
+        self._profile.disable()
+        duration = monotonic() - self._started
+
+        out = io.StringIO()
+        out.write("Profiled %.1f second(s)\n\n" % duration)
+        stats = pstats.Stats(self._profile, stream=out)
+        stats.sort_stats("cumulative").print_stats(self._limit)
+        self._profile = None
+        return out.getvalue()
+
+
+class LagMonitor:
+
+    def __init__(self, threshold=0.25, interval=0.5):
+        """Constructor.
+
+        Args:
+            threshold: The event loop lag (in seconds) above which a warning
+                and a stack snapshot are logged.
+            interval: The interval (in seconds) at which the lag is sampled.
+        """
+        self._threshold = threshold
+        self._interval = interval
+        self._task = None
+        self._watchdog = None
+        self._stopped = threading.Event()
+        self._loop_thread = None
+        self._heartbeat = monotonic()
+        self._pending = None
+
+    @property
+    def running(self):
+        """Whether the monitor is currently active."""
+        return self._task is not None
+
+    def start(self):
+        """Starts the monitor. Must be called from within the event loop."""
+        if self.running:
+            return
+        self._loop_thread = threading.get_ident()
+        self._heartbeat = monotonic()
+        self._stopped.clear()
+        self._task = asyncio.ensure_future(self._sample())
+        self._watchdog = threading.Thread(target=self._watch, daemon=True,
+                                          name="lag-watchdog")
+        self._watchdog.start()
+
+    def stop(self):
+        """Stops the monitor."""
+        if not self.running:
+            return
+        self._stopped.set()
+        self._task.cancel()
+        self._task = None
+        self._watchdog = None
+
+    async def _sample(self):
+        """Measures how late the event loop wakes up from sleeping."""
+        while True:
+            heartbeat = self._heartbeat
+            before = monotonic()
+            await asyncio.sleep(self._interval)
+            self._heartbeat = monotonic()
+            lag = self._heartbeat - before - self._interval
+            if lag > self._threshold:
+                log("Event loop lag: %.3fs" % lag)
+
+                # Report stalls that ended before the watchdog reported them
+                pending = self._pending
+                if pending is not None and pending[0] == heartbeat:
+                    log("Event loop blocked for %.3fs at:\n%s"
+                        % (lag, pending[1]))
+
+    def _watch(self):
+        """Logs the event loop stack while the loop is blocked."""
+        # Poll well below the threshold so that short stalls are caught too
+        poll = min(self._interval, self._threshold) / 4
+        reported = None
+        while not self._stopped.wait(poll):
+            # The loop is stalled once it misses its expected wake-up time
+            heartbeat = self._heartbeat
+            stalled = monotonic() - heartbeat - self._interval
+            if stalled <= self._threshold - poll or reported == heartbeat:
+                continue
+
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            stack = "".join(traceback.format_stack(frame))
+            if stalled <= self._threshold:
+                # The stall might end before the next poll but still exceed
+                # the threshold, in which case _sample reports this stack
+                self._pending = (heartbeat, stack)
+                continue
+
+            # Only report each stall once
+            reported = heartbeat
+            self._pending = None
+            log("Event loop blocked for %.3fs at:\n%s" % (stalled, stack))
@@ -0,0 +1,77 @@
+import asyncio
+from time import monotonic
+
+
+class SingleFlight:
+
+    def __init__(self):
+        """Constructor."""
+        self._calls = {}
+
+    async def do(self, key, func, snapshot):
+        """Runs a function in the default executor, sharing identical calls.
+
+        If a call with the same key is still in progress, no new call is made
+        and the result of the running call is returned instead.
+
+        Args:
+            key: The (hashable) key identifying the call.
+            func: The function. It is passed the result of snapshot and must
+                not touch state owned by the event loop.
+            snapshot: A function that copies the input for func. It is only
+                called, on the event loop, when a new call is started.
+
+        Returns:
+            The result of the function.
+        """
+        future = self._calls.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(None, func, snapshot())
+            self._calls[key] = future
+            future.add_done_callback(lambda f: self._calls.pop(key, None))
+
+        # A cancelled waiter must not cancel the call for the other waiters
+        return await asyncio.shield(future)
+
+
+class ReplyCollapser:
+
+    def __init__(self, window):
+        """Constructor.
+
+        Args:
+            window: The time (in seconds) during which identical replies to the
+                same channel are collapsed. Collapsing is disabled if this is 0.
+        """
+        self._window = window
+        self._recent = {}
+
+    def should_send(self, channel, key):
+        """Checks whether a reply should be sent and records it if so.
+
+        Args:
+            channel: The channel the reply is for.
+            key: The (hashable) key identifying the reply contents.
+
+        Returns:
+            False if an identical reply was sent to the channel within the
+            window, True otherwise.
+        """
+        if self._window <= 0:
+            return True
+        now = monotonic()
+
+        # Entries are kept in the order they were sent, so expired entries are
+        # always at the front
+        while len(self._recent) > 0:
+            old, sent = next(iter(self._recent.items()))
+            if now - sent < self._window:
+                break
+            del self._recent[old]
+
+        key = (channel.id, key)
+        if key in self._recent:
+            return False
+        self._recent[key] = now
+        return True
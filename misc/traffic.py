@@ -0,0 +1,71 @@
+from json import dumps, loads
+from misc.util import log
+from time import time
+
+
+class TrafficRecorder:
+
+    def __init__(self, path, commands, admins):
+        """Constructor.
+
+        Args:
+            path: The file the traffic is appended to.
+            commands: The command labels that are recorded. Other messages
+                starting with the command prefix are ignored.
+            admins: The IDs of the admins.
+        """
+        self._file = open(path, "a", encoding="utf-8", buffering=1)
+        self._commands = set(commands)
+        self._admins = admins
+
+    def record(self, cmd, args, author_id):
+        """Records a command.
+
+        Only the time, the command, its arguments and whether the author is an
+        admin are written, nothing that identifies the author or the channel.
+
+        Args:
+            cmd: The command label.
+            args: The command arguments.
+            author_id: The ID of the author of the command.
+        """
+        if cmd not in self._commands:
+            return
+        deck = None
+        if cmd == "kgf" and len(args) > 1 and args[0] != "profile":
+            deck = args[1].lower()
+        admin = author_id in self._admins
+        entry = [round(time(), 3), cmd, deck, admin, args]
+
+        # Failing to record must never drop the command itself
+        try:
+            self._file.write(dumps(entry, separators=(",", ":")) + "\n")
+        except OSError as e:
+            log("Could not record traffic: %s" % e)
+
+    def close(self):
+        """Closes the traffic log."""
+        try:
+            self._file.close()
+        except OSError as e:
+            log("Could not close traffic log: %s" % e)
+
+
+def load_traffic(path):
+    """Loads a traffic log.
+
+    Args:
+        path: The traffic log file.
+
+    Returns:
+        A list of (time, cmd, deck, admin, args) tuples sorted by time, where
+        time is relative to the first entry.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        entries = [tuple(loads(line)) for line in f if line.strip()]
+    entries.sort(key=lambda e: e[0])
+    if len(entries) == 0:
+        return entries
+    start = entries[0][0]
+    return [(t - start, cmd, deck, admin, args)
+            for t, cmd, deck, admin, args in entries]
@@ -1,8 +1,15 @@
+from itertools import count
+
+# Revisions are unique across all decks of the process, they are not persisted
+_revisions = count(1)
+
+
 class Deck:
 
     def __init__(self):
         """Constructor."""
         self.cards = []
+        self.revision = next(_revisions)
 
     def add_card(self, category, text):
         """Adds a card to the deck.
@@ -31,6 +38,20 @@ class Deck:
             raise ValueError("Card already existing")
 
         self.cards.append(card)
+        self.revision = next(_revisions)
+
+    def remove_card(self, id):
+        """Removes a card from the deck.
+
+        Args:
+            id: The card ID.
+
+        Returns:
+            The removed card.
+        """
+        card = self.cards.pop(id)
+        self.revision = next(_revisions)
+        return card
 
     def card_stats(self):
         """Returns card stats.
@@ -49,7 +70,8 @@ class Deck:
 
     @staticmethod
     def json(o):
-        r = o.__dict__
+        r = dict(o.__dict__)
+        del r["revision"]
         r["__class"] = "Deck"
         return r
 
@@ -57,7 +79,11 @@ class Deck:
     def unjson(j):
         if "__class" in j and j["__class"] == "Deck":
             del j["__class"]
+            j.pop("revision", None)
             o = Deck()
             o.__dict__.update(j)
+
+            # JSON has no tuples, restore them for the duplicate check
+            o.cards = [tuple(card) for card in o.cards]
             return o
         return j
@@ -0,0 +1,208 @@
+import random
+import re
+from zlib import crc32
+
+
+class MinHashIndex:
+
+    # Mersenne prime used for the universal hash family
+    _PRIME = (1 << 61) - 1
+    _MAX_HASH = (1 << 32) - 1
+
+    def __init__(self, threshold=0.7, num_perm=64, shingle_size=3, seed=1):
+        """Constructor.
+
+        Args:
+            threshold: The estimated Jaccard similarity at which two texts are
+                considered near-duplicates.
+            num_perm: The number of hash permutations per signature. Memory
+                usage of the index grows linearly with this value.
+            shingle_size: The size of the character shingles.
+            seed: The seed for the hash permutations.
+        """
+        if not 0.0 < threshold <= 1.0:
+            raise ValueError("Threshold must be in (0, 1]")
+        if num_perm < 1:
+            raise ValueError("Need at least one permutation")
+
+        self.threshold = threshold
+        self._num_perm = num_perm
+        self._shingle_size = shingle_size
+        self._bands, self._rows = self._optimal_bands(threshold, num_perm)
+
+        rng = random.Random(seed)
+        self._perms = [(rng.randrange(1, self._PRIME),
+                        rng.randrange(0, self._PRIME))
+                       for _ in range(num_perm)]
+
+        # key -> signature and band -> bucket -> set of keys
+        self._signatures = {}
+        self._buckets = [{} for _ in range(self._bands)]
+
+    @staticmethod
+    def _optimal_bands(threshold, num_perm):
+        """Picks the LSH band layout whose S-curve is steepest at the threshold.
+
+        Args:
+            threshold: The similarity threshold.
+            num_perm: The number of permutations.
+
+        Returns:
+            A tuple (bands, rows) with bands * rows <= num_perm.
+        """
+        best = (num_perm, 1)
+        best_err = None
+        for rows in range(1, num_perm + 1):
+            bands = num_perm // rows
+            err = abs((1.0 / bands) ** (1.0 / rows) - threshold)
+            if best_err is None or err < best_err:
+                best, best_err = (bands, rows), err
+        return best
+
+    def _shingles(self, text, namespace):
+        """Splits a normalized text into character shingles.
+
+        Args:
+            text: The text.
+            namespace: The namespace of the text.
+
+        Returns:
+            The set of shingle hashes.
+        """
+        # Gaps (_) are kept, texts consisting only of punctuation are kept as-is
+        normalized = re.sub(r"\W+", " ", text.lower()).strip()
+        if normalized == "":
+            normalized = text.lower()
+
+        # Shingles from different namespaces never collide
+        salt = crc32(namespace.encode())
+        k = self._shingle_size
+        if len(normalized) <= k:
+            return {crc32(normalized.encode(), salt)}
+        return {crc32(normalized[i:i + k].encode(), salt)
+                for i in range(len(normalized) - k + 1)}
+
+    def signature(self, text, namespace=""):
+        """Computes the MinHash signature of a text.
+
+        This does not modify the index and may be called from other threads.
+
+        Args:
+            text: The text.
+            namespace: The namespace of the text. Texts from different
+                namespaces are never similar.
+
+        Returns:
+            The signature as a tuple of ints.
+        """
+        shingles = self._shingles(text, namespace)
+        p, m = self._PRIME, self._MAX_HASH
+        return tuple(min(((a * s + b) % p) & m for s in shingles)
+                     for a, b in self._perms)
+
+    def _bands_of(self, sig):
+        """Splits a signature into its LSH bands.
+
+        Args:
+            sig: The signature.
+
+        Returns:
+            A list with one tuple of rows per band.
+        """
+        r = self._rows
+        return [sig[i * r:(i + 1) * r] for i in range(self._bands)]
+
+    def add(self, key, text, namespace=""):
+        """Adds a text to the index. Re-adding a key replaces its text.
+
+        Args:
+            key: The (hashable) key for the text.
+            text: The text.
+            namespace: The namespace of the text.
+        """
+        self.insert(key, self.signature(text, namespace))
+
+    def insert(self, key, sig):
+        """Adds a precomputed signature to the index.
+
+        Args:
+            key: The (hashable) key for the signature.
+            sig: The signature, see signature().
+        """
+        if key in self._signatures:
+            self.remove(key)
+        self._signatures[key] = sig
+        for bucket, band in zip(self._buckets, self._bands_of(sig)):
+            bucket.setdefault(band, set()).add(key)
+
+    def remove(self, key):
+        """Removes a key from the index, if it is present.
+
+        Args:
+            key: The key.
+        """
+        sig = self._signatures.pop(key, None)
+        if sig is None:
+            return
+        for bucket, band in zip(self._buckets, self._bands_of(sig)):
+            keys = bucket.get(band)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del bucket[band]
+
+    def query(self, text, exclude=None, namespace=""):
+        """Finds near-duplicates of a text.
+
+        Args:
+            text: The text.
+            exclude: A key that should not be reported (e.g. the text itself).
+            namespace: The namespace of the text.
+
+        Returns:
+            A list of (key, similarity) tuples with an estimated similarity of
+            at least the threshold, most similar first.
+        """
+        return self._query_sig(self.signature(text, namespace), exclude)
+
+    def query_key(self, key):
+        """Finds near-duplicates of an indexed key.
+
+        Args:
+            key: The key.
+
+        Returns:
+            See query().
+        """
+        sig = self._signatures.get(key)
+        if sig is None:
+            return []
+        return self._query_sig(sig, key)
+
+    def _query_sig(self, sig, exclude):
+        """Finds near-duplicates of a signature.
+
+        Args:
+            sig: The signature.
+            exclude: A key that should not be reported.
+
+        Returns:
+            See query().
+        """
+        candidates = set()
+        for bucket, band in zip(self._buckets, self._bands_of(sig)):
+            candidates.update(bucket.get(band, ()))
+        candidates.discard(exclude)
+
+        results = []
+        for key in candidates:
+            other = self._signatures[key]
+            same = sum(1 for x, y in zip(sig, other) if x == y)
+            similarity = same / self._num_perm
+            if similarity >= self.threshold:
+                results.append((key, similarity))
+        results.sort(key=lambda r: -r[1])
+        return results
+
+    def __len__(self):
+        return len(self._signatures)
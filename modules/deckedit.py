@@ -1,9 +1,13 @@
 import asyncio
 import discord
 import io
+import traceback
+from functools import partial
 from json import load, dump
+from misc.singleflight import ReplyCollapser, SingleFlight
 from misc.util import create_embed, log
 from model.deck import Deck
+from model.minhash import MinHashIndex
 from modules.module import Module
 from os.path import exists
 
@@ -29,10 +33,58 @@ class DeckEditModule(Module):
         self._results_limit = self._frontend.config.get("search-result-limit",
                                                         10)
 
+        # Share identical in-flight requests and optionally collapse replies
+        self._flights = SingleFlight()
+        self._replies = ReplyCollapser(
+            self._frontend.config.get("reply-collapse-window", 0))
+
         # Load the decks from disk
         with open(self._deck_file, "r") as f:
             self._decks = load(f, object_hook=Deck.unjson)
 
+        # Build the near-duplicate index over all decks in the background
+        config = self._frontend.config
+        self._dupe_warning = config.get("dupe-warning", True)
+        self._dupes = MinHashIndex(config.get("dupe-threshold", 0.7),
+                                   config.get("dupe-num-perm", 64))
+        self._dupes_ready = False
+        self._dupes_task = asyncio.ensure_future(self._build_dupes())
+        self._dupes_task.add_done_callback(self._dupes_built)
+
+    async def _build_dupes(self):
+        """Builds the near-duplicate index without blocking the event loop."""
+        cards = [(deckname, card) for deckname, deck in self._decks.items()
+                 for card in deck.cards]
+        loop = asyncio.get_running_loop()
+        sigs = await loop.run_in_executor(
+            None, lambda: [self._dupes.signature(card[1], card[0])
+                           for _, card in cards])
+
+        # Skip cards that were removed while the signatures were computed.
+        # Cards added in the meantime have already been indexed.
+        present = {self._dupe_key(deckname, card)
+                   for deckname, deck in self._decks.items()
+                   for card in deck.cards}
+        for (deckname, card), sig in zip(cards, sigs):
+            key = self._dupe_key(deckname, card)
+            if key in present:
+                self._dupes.insert(key, sig)
+        self._dupes_ready = True
+        log("Near-duplicate index built, %d card(s)." % len(self._dupes))
+
+    def _dupes_built(self, task):
+        """Logs a failed build of the near-duplicate index.
+
+        Args:
+            task: The finished build task.
+        """
+        if task.cancelled() or task.exception() is None:
+            return
+        e = task.exception()
+        log("Building the near-duplicate index failed:\n%s"
+            % "".join(traceback.format_exception(type(e), e,
+                                                 e.__traceback__)))
+
     def save_decks(self):
         """Saves all decks."""
         with open(self._deck_file, "w") as f:
@@ -58,8 +110,10 @@ class DeckEditModule(Module):
                  + "|replace <deck> <id> <type> <text...>" \
                  + "|search <deck> <query...>" \
                  + "|delete <deck> <id>" \
+                 + "|dupes <deck>" \
                  + "|download <deck>" \
-                 + "|export <deck>>"
+                 + "|export <deck>" \
+                 + "|profile <start|stop>>"
 
         if len(args) == 0:
             await msg.channel.send(syntax)
@@ -75,6 +129,14 @@ class DeckEditModule(Module):
         if len(args) < 2:
             await msg.channel.send(syntax)
             return
+
+        if args[0] == "profile":
+            if admin:
+                await self._cmd_profile(msg.channel, args[1].lower())
+            else:
+                await self._perm_error(msg.channel)
+            return
+
         deck = args[1].lower()
 
         if args[0] == "create":
@@ -100,8 +162,12 @@ class DeckEditModule(Module):
         if args[0] == "export":
             await self._cmd_export(msg.channel, deck, deck_name)
 
+        if args[0] == "dupes":
+            await self._cmd_dupes(msg.channel, deck, deck_name)
+
         if args[0] == "add" and len(args) >= 4:
-            await self._cmd_add(msg.channel, deck, args[2], " ".join(args[3:]))
+            await self._cmd_add(msg.channel, deck, deck_name, args[2],
+                                " ".join(args[3:]))
 
         if args[0] == "replace" and len(args) >= 5:
             try:
@@ -109,10 +175,12 @@ class DeckEditModule(Module):
             except:
                 pass
             else:
-                await self._cmd_replace(msg.channel, deck, id, args[3], " ".join(args[4:]))
+                await self._cmd_replace(msg.channel, deck, deck_name, id,
+                                        args[3], " ".join(args[4:]))
 
         if args[0] == "search" and len(args) >= 3:
-            await self._cmd_search(msg.channel, deck, " ".join(args[2:]))
+            await self._cmd_search(msg.channel, deck, deck_name,
+                                   " ".join(args[2:]))
 
         if args[0] == "delete" and len(args) == 3:
             try:
@@ -120,7 +188,7 @@ class DeckEditModule(Module):
             except:
                 pass
             else:
-                await self._cmd_delete(msg.channel, deck, id)
+                await self._cmd_delete(msg.channel, deck, deck_name, id)
 
         if args[0] == "remove-deck":
             if admin:
@@ -129,19 +197,21 @@ class DeckEditModule(Module):
                 await self._perm_error(msg.channel)
             return
 
-    async def _cmd_delete(self, channel, deck, id):
+    async def _cmd_delete(self, channel, deck, deckname, id):
         """Handles the delete subcommand.
 
         Args:
             channel: The channel in which the command was executed.
             deck: The deck that was requested.
+            deckname: The name of the requested deck.
             id: The card ID to delete.
         """
         if len(deck.cards) <= id or id < 0:
             await self._error(channel, "Invalid ID", "This ID is invalid.")
             return
 
-        del deck.cards[id]
+        card = deck.remove_card(id)
+        self._dupes.remove(self._dupe_key(deckname, card))
         await channel.send("Card Removed -- WARNING: Card IDs have changed!")
 
     async def _cmd_download(self, channel, deck, deckname):
@@ -152,13 +222,30 @@ class DeckEditModule(Module):
             deck: The requested deck.
             deckname: The name of the requested deck.
         """
+        key = ("download", deckname, deck.revision)
+        data = await self._flights.do(key, self._render_download,
+                                      lambda: list(deck.cards))
+        if not self._replies.should_send(channel, key):
+            return
+        fp = discord.File(io.BytesIO(data), deckname + ".txt")
+        await channel.send("Evaluation Download -- Not usable for playing",
+                           file=fp)
+
+    @staticmethod
+    def _render_download(cards):
+        """Renders the download file for a deck.
+
+        Args:
+            cards: A snapshot of the cards of the deck.
+
+        Returns:
+            The encoded file contents.
+        """
         desc = "KgF Deck (DO NOT USE THIS FILE TO PLAY)\r\n\r\n"
         fmt = "#%d (%s) -- %s\r\n"
-        for i, card in enumerate(deck.cards):
+        for i, card in enumerate(cards):
             desc += fmt % (i, card[0], card[1])
-        fp = discord.File(io.BytesIO(desc.encode()), deckname + ".txt")
-        await channel.send("Evaluation Download -- Not usable for playing",
-                           file=fp)
+        return desc.encode()
 
     async def _cmd_export(self, channel, deck, deckname):
         """Handles the export subcommand.
@@ -168,12 +255,56 @@ class DeckEditModule(Module):
             deck: The requested deck.
             deckname: The name of the requested deck.
         """
+        key = ("export", deckname, deck.revision)
+        data = await self._flights.do(key, self._render_export,
+                                      lambda: list(deck.cards))
+        if not self._replies.should_send(channel, key):
+            return
+        fp = discord.File(io.BytesIO(data), deckname + ".tsv")
+        await channel.send("Deck Export -- Ready for playing", file=fp)
+
+    @staticmethod
+    def _render_export(cards):
+        """Renders the export file for a deck.
+
+        Args:
+            cards: A snapshot of the cards of the deck.
+
+        Returns:
+            The encoded file contents.
+        """
         desc = ""
         fmt = "%s\t%s\n"
-        for card in deck.cards:
+        for card in cards:
             desc += fmt % (card[1], card[0])
-        fp = discord.File(io.BytesIO(desc.encode()), deckname + ".tsv")
-        await channel.send("Deck Export -- Ready for playing", file=fp)
+        return desc.encode()
+
+    async def _cmd_profile(self, channel, action):
+        """Handles the profile subcommand.
+
+        Args:
+            channel: The channel in which the command was executed.
+            action: Either start or stop.
+        """
+        profiler = self._frontend.profiler
+        if action == "start":
+            try:
+                profiler.start()
+            except ValueError as e:
+                await self._error(channel, "Could Not Start", str(e))
+                return
+            await channel.send("Profiling started.")
+        elif action == "stop":
+            try:
+                report = profiler.stop()
+            except ValueError as e:
+                await self._error(channel, "Could Not Stop", str(e))
+                return
+            fp = discord.File(io.BytesIO(report.encode()), "profile.txt")
+            await channel.send("Profiling Report", file=fp)
+        else:
+            await self._error(channel, "Unknown Action",
+                              "Use `start` or `stop`.")
 
     async def _cmd_remove_deck(self, channel, deckname):
         """Handles the remove-deck subcommand.
@@ -182,6 +313,8 @@ class DeckEditModule(Module):
             channel: The channel in which the command was executed.
             deckname: The name of the deck.
         """
+        for card in self._decks[deckname].cards:
+            self._dupes.remove(self._dupe_key(deckname, card))
         del self._decks[deckname]
         self.save_decks()
         await channel.send("Deck removed.")
@@ -217,29 +350,35 @@ class DeckEditModule(Module):
         self.save_decks()
         await channel.send("Deck created.")
 
-    async def _cmd_add(self, channel, deck, type, text):
+    async def _cmd_add(self, channel, deck, deckname, type, text):
         """Handles the add subcommand.
 
         Args:
             channel: The channel in which the command was executed.
             deck: The requested deck.
+            deckname: The name of the requested deck.
             type: The requested card type.
             text: The requested text for the card.
         """
         try:
             deck.add_card(type, text)
+            key = self._dupe_key(deckname, deck.cards[-1])
+            self._dupes.add(key, text, deck.cards[-1][0])
             self.save_decks()
             embed = create_embed("New " + type, "`%s`" % text, 0x00AA00)
             await channel.send(embed=embed)
         except ValueError as e:
             await self._error(channel, "Could Not Add", str(e))
+            return
+        await self._warn_dupes(channel, key)
 
-    async def _cmd_replace(self, channel, deck, id, type, text):
+    async def _cmd_replace(self, channel, deck, deckname, id, type, text):
         """Handles the replace subcommand.
 
         Args:
             channel: The channel in which the command was executed.
             deck: The deck that was requested.
+            deckname: The name of the requested deck.
             id: The card ID to replace.
             type: The requested card type.
             text: The requested text for the card.
@@ -247,42 +386,165 @@ class DeckEditModule(Module):
         if len(deck.cards) <= id or id < 0:
             await self._error(channel, "Invalid ID", "This ID is invalid.")
             return
+        old = deck.cards[id]
         try:
             deck.add_card(type, text)
             deck.cards[id] = deck.cards.pop()
+            self._dupes.remove(self._dupe_key(deckname, old))
+            key = self._dupe_key(deckname, deck.cards[id])
+            self._dupes.add(key, text, deck.cards[id][0])
             self.save_decks()
             embed = create_embed("Replaced card #%d with %s" % (id, type),
                                  "`%s`" % text, 0x00AA00)
             await channel.send(embed=embed)
         except ValueError as e:
             await self._error(channel, "Could Not Add", str(e))
+            return
+        await self._warn_dupes(channel, key)
+
+    async def _cmd_dupes(self, channel, deck, deckname):
+        """Handles the dupes subcommand.
 
-    async def _cmd_search(self, channel, deck, query):
+        Args:
+            channel: The channel in which the command was executed.
+            deck: The requested deck.
+            deckname: The name of the requested deck.
+        """
+        if not self._dupes_ready:
+            if self._dupes_task.done():
+                await self._error(channel, "Index Unavailable", "Building the"
+                                  + " near-duplicate index failed.")
+            else:
+                await self._error(channel, "Index Not Ready", "The near-"
+                                  + "duplicate index is still being built.")
+            return
+
+        pairs = []
+        card_ids = {}
+        for id, card in enumerate(deck.cards):
+            key = self._dupe_key(deckname, card)
+            for other, similarity in self._dupes.query_key(key):
+                other_id = self._card_id(card_ids, other)
+                # Report each pair within the deck only once
+                if other[0] == deckname and other_id < id:
+                    continue
+                pairs.append("#%d ~ `%s`#%d (%d%%): `%s`"
+                             % (id, other[0], other_id, similarity * 100,
+                                card[1]))
+
+        title = "Near-Duplicates"
+        if len(pairs) > self._results_limit:
+            title += " (showing first %d of %d results)" % (self._results_limit,
+                                                            len(pairs))
+        if len(pairs) == 0:
+            title = "No Near-Duplicates"
+        embed = create_embed(title, "\n".join(pairs[:self._results_limit]),
+                             0x00AA00)
+        await channel.send(embed=embed)
+
+    async def _warn_dupes(self, channel, key):
+        """Warns about near-duplicates of a freshly added card.
+
+        Args:
+            channel: The channel in which the command was executed.
+            key: The near-duplicate index key of the card.
+        """
+        if not self._dupe_warning:
+            return
+        similar = self._dupes.query_key(key)[:self._results_limit]
+        if len(similar) == 0:
+            return
+        card_ids = {}
+        msg = "\n".join("`%s`#%d (%d%%)" % (other[0],
+                                            self._card_id(card_ids, other),
+                                            similarity * 100)
+                        for other, similarity in similar)
+        embed = create_embed("Warning - Possible Near-Duplicate", msg, 0xAAAA00)
+        await channel.send(embed=embed)
+
+    @staticmethod
+    def _dupe_key(deckname, card):
+        """Builds the near-duplicate index key for a card.
+
+        The key is based on the identity of the card object, so that equal
+        cards still get their own keys. It stays valid as long as the card is
+        in the deck.
+
+        Args:
+            deckname: The name of the deck containing the card.
+            card: The card.
+
+        Returns:
+            The key.
+        """
+        return (deckname, id(card))
+
+    def _card_id(self, card_ids, key):
+        """Looks up the current card ID for a near-duplicate index key.
+
+        Args:
+            card_ids: A cache mapping deck names to {key: card ID} maps. It
+                should only be reused while no cards are modified.
+            key: The key.
+
+        Returns:
+            The card ID within the deck named by the key.
+        """
+        deckname = key[0]
+        if deckname not in card_ids:
+            card_ids[deckname] = {
+                self._dupe_key(deckname, card): id
+                for id, card in enumerate(self._decks[deckname].cards)
+            }
+        return card_ids[deckname][key]
+
+    async def _cmd_search(self, channel, deck, deckname, query):
         """Handles the search subcommand.
 
         Args:
             channel: The channel in which the command was executed.
             deck: The requested deck.
+            deckname: The name of the requested deck.
             query: The search query.
         """
+        query = query.lower()
+        key = ("search", deckname, deck.revision, query)
+        search = partial(self._search, query=query, limit=self._results_limit)
+        title, msg = await self._flights.do(key, search,
+                                            lambda: list(deck.cards))
+        if not self._replies.should_send(channel, key):
+            return
+        embed = create_embed(title, msg, 0x00AA00)
+        await channel.send(embed=embed)
+
+    @staticmethod
+    def _search(cards, query, limit):
+        """Searches the cards of a deck.
+
+        Args:
+            cards: A snapshot of the cards of the deck.
+            query: The lowercase search query.
+            limit: The maximum number of results shown.
+
+        Returns:
+            A tuple (title, message) describing the results.
+        """
         results = []
         search_results = 0
-        query = query.lower()
-        for id, entry in enumerate(deck.cards):
+        for id, entry in enumerate(cards):
             _, card = entry
             if query in card.lower():
-                if search_results < self._results_limit:
+                if search_results < limit:
                     results.append((id, card))
                 search_results += 1
         title = "Search Results"
-        if search_results > self._results_limit:
-            title += " (showing first %d of %d results)" % (self._results_limit,
+        if search_results > limit:
+            title += " (showing first %d of %d results)" % (limit,
                                                             search_results)
         if search_results == 0:
             title = "No Results"
         msg = "\n".join(["#%d: `%s`" % (id, card) for id, card in results])
-        embed = create_embed(title, msg, 0x00AA00)
-        await channel.send(embed=embed)
+        return title, msg
 
     async def _cmd_stats(self, channel, deck):
         """Handles the stats subcommand.
@@ -0,0 +1,240 @@
+"""Replays a recorded traffic log against an in-process bot.
+
+The replay runs in a scratch copy of the configuration and decks so that the
+live data is never modified. Every command is issued into one of several fake
+channels by a fake admin or a fake regular user, depending on whether it was
+recorded from an admin. Profiling commands are skipped.
+
+Usage: python3 replay.py <traffic-log> [--speed N] [--concurrency N]
+"""
+import argparse
+import asyncio
+import math
+import os
+import shutil
+import tempfile
+from bot import Bot
+from misc.traffic import load_traffic
+from modules.deckedit import DeckEditModule
+from time import monotonic
+
+
+class FakeAuthor:
+
+    def __init__(self, id):
+        """Constructor.
+
+        Args:
+            id: The user ID.
+        """
+        self.id = id
+        self.bot = False
+
+
+class FakeChannel:
+
+    def __init__(self, id):
+        """Constructor.
+
+        Args:
+            id: The channel ID.
+        """
+        self.id = id
+        self.messages = 0
+        self.files = 0
+
+    async def trigger_typing(self):
+        pass
+
+    async def send(self, content=None, embed=None, file=None):
+        self.messages += 1
+        if file is not None:
+            self.files += 1
+
+
+class FakeMessage:
+
+    def __init__(self, author, channel):
+        """Constructor.
+
+        Args:
+            author: The author of the message.
+            channel: The channel of the message.
+        """
+        self.author = author
+        self.channel = channel
+
+
+def percentile(values, p):
+    """Computes a nearest-rank percentile.
+
+    Args:
+        values: The sorted values.
+        p: The percentile in [0, 100].
+
+    Returns:
+        The percentile.
+    """
+    rank = max(0, min(len(values) - 1, math.ceil(p / 100 * len(values)) - 1))
+    return values[rank]
+
+
+def instrument_saves(module, timings):
+    """Records the duration of every save of a deck module.
+
+    Args:
+        module: The DeckEditModule.
+        timings: The list the durations are appended to.
+    """
+    save = module.save_decks
+
+    def timed_save():
+        start = monotonic()
+        save()
+        timings.append(monotonic() - start)
+
+    module.save_decks = timed_save
+
+
+async def replay(entries, speed, concurrency, channels):
+    """Replays traffic against a fresh bot in the current directory.
+
+    Args:
+        entries: The traffic entries, see load_traffic().
+        speed: The speed multiple relative to the recorded timing.
+        concurrency: The maximum number of commands in flight.
+        channels: The number of fake channels.
+
+    Returns:
+        A tuple (elapsed, latencies, errors, saves, channels, skipped) where
+        latencies maps a command label to a list of latencies.
+    """
+    frontend = Bot()
+    admin = FakeAuthor(0)
+    user = FakeAuthor(1)
+    admins = frontend.config.get("admins", [])
+    admins[:] = [admin.id]
+    module = DeckEditModule(frontend, None)
+    frontend.modules = [module]
+    saves = []
+    instrument_saves(module, saves)
+
+    fake_channels = [FakeChannel(i) for i in range(channels)]
+    latencies = {}
+    errors = []
+    limit = asyncio.Semaphore(concurrency)
+
+    async def issue(msg, cmd, args):
+        label = cmd if cmd != "kgf" or len(args) == 0 else cmd + " " + args[0]
+        start = monotonic()
+        try:
+            await frontend.handle_command(msg, cmd, args)
+        except Exception as e:
+            errors.append("%s: %r" % (label, e))
+        finally:
+            latencies.setdefault(label, []).append(monotonic() - start)
+            limit.release()
+
+    tasks = []
+    skipped = 0
+    start = monotonic()
+    for i, (t, cmd, _, is_admin, args) in enumerate(entries):
+        # Do not profile the load test
+        if cmd == "kgf" and len(args) > 0 and args[0] == "profile":
+            skipped += 1
+            continue
+
+        delay = start + t / speed - monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        await limit.acquire()
+        msg = FakeMessage(admin if is_admin else user,
+                          fake_channels[i % channels])
+        tasks.append(asyncio.ensure_future(issue(msg, cmd, list(args))))
+    await asyncio.gather(*tasks)
+    elapsed = monotonic() - start
+
+    return elapsed, latencies, errors, saves, fake_channels, skipped
+
+
+def report(elapsed, latencies, errors, saves, channels, skipped):
+    """Prints a replay report.
+
+    Args:
+        See the return value of replay().
+    """
+    total = sum(len(v) for v in latencies.values())
+    print("%d command(s) in %.2fs (%.1f/s), %d error(s), %d skipped"
+          % (total, elapsed, total / elapsed if elapsed else 0, len(errors),
+             skipped))
+    print("%d message(s), %d file(s) sent"
+          % (sum(c.messages for c in channels), sum(c.files for c in channels)))
+    print()
+
+    fmt = "%-20s %7s %9s %9s %9s %9s"
+    print(fmt % ("command", "count", "p50 ms", "p90 ms", "p99 ms", "max ms"))
+    everything = []
+    for label in sorted(latencies):
+        values = sorted(latencies[label])
+        everything.extend(values)
+        print(fmt % (label, len(values),
+                     "%.2f" % (percentile(values, 50) * 1000),
+                     "%.2f" % (percentile(values, 90) * 1000),
+                     "%.2f" % (percentile(values, 99) * 1000),
+                     "%.2f" % (values[-1] * 1000)))
+    if len(everything) > 0:
+        everything.sort()
+        print(fmt % ("(all)", len(everything),
+                     "%.2f" % (percentile(everything, 50) * 1000),
+                     "%.2f" % (percentile(everything, 90) * 1000),
+                     "%.2f" % (percentile(everything, 99) * 1000),
+                     "%.2f" % (everything[-1] * 1000)))
+    print()
+
+    size = os.path.getsize("decks.json") if os.path.exists("decks.json") else 0
+    if len(saves) > 0:
+        print("%d save(s), %.2fms total, %.2fms mean, %.2fms max, %d bytes"
+              % (len(saves), sum(saves) * 1000,
+                 sum(saves) / len(saves) * 1000, max(saves) * 1000, size))
+    else:
+        print("0 saves, %d bytes" % size)
+
+    for error in errors[:10]:
+        print("ERROR", error)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded traffic.")
+    parser.add_argument("log", help="the traffic log to replay")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="speed multiple of the recorded timing")
+    parser.add_argument("--concurrency", type=int, default=16,
+                        help="maximum number of commands in flight")
+    parser.add_argument("--channels", type=int, default=4,
+                        help="number of fake channels")
+    options = parser.parse_args()
+    if options.speed <= 0:
+        parser.error("--speed must be positive")
+    if options.concurrency <= 0:
+        parser.error("--concurrency must be positive")
+    if options.channels <= 0:
+        parser.error("--channels must be positive")
+
+    entries = load_traffic(options.log)
+
+    # Work on a scratch copy of the bot data
+    workdir = tempfile.mkdtemp(prefix="kgf-replay-")
+    for name in ("config.json", "decks.json"):
+        if os.path.exists(name):
+            shutil.copy(name, workdir)
+    os.chdir(workdir)
+    try:
+        results = asyncio.run(replay(entries, options.speed,
+                                     options.concurrency, options.channels))
+        report(*results)
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()